@@ -9,6 +9,7 @@ from __future__ import absolute_import
 
 import sys
 import os
+import collections
 import numpy
 import logging
 
@@ -21,6 +22,94 @@ from atooms.core.utils import mkdir
 _log = logging.getLogger(__name__)
 _version = rumd.GetVersion()
 
+# Compiled forcefield files, keyed by (path, mtime)
+_forcefield_cache = {}
+
+Diagnostics = collections.namedtuple('Diagnostics',
+                                     ['rmsd', 'kinetic_energy', 'temperature'])
+
+
+def _parse_forcefield(forcefield_file):
+    """
+    Execute `forcefield_file` and return the list of potentials it
+    defines (a list named `potential`).
+
+    The compiled code object is cached so that creating many backends
+    from the same forcefield file does not reparse the source.
+    """
+    key = (forcefield_file, os.path.getmtime(forcefield_file))
+    code = _forcefield_cache.get(key)
+    if code is None:
+        with open(forcefield_file) as fh:
+            code = compile(fh.read(), forcefield_file, 'exec')
+        _forcefield_cache[key] = code
+    namespace = {'rumd': rumd}
+    exec(code, namespace)
+    if 'potential' not in namespace:
+        raise ValueError('forcefield file should contain a list of potentials named potential')
+    return namespace['potential']
+
+# Optional numba kernels. We fall back to numpy if numba is missing.
+_HAVE_NUMBA = True
+try:
+    import numba
+
+    @numba.njit(cache=True, parallel=True, fastmath=True)
+    def _rmsd_squared(pos, ima, ref_pos, ref_ima, L):
+        # Fused unfold + squared-displacement reduction in one pass,
+        # without materializing the unfolded arrays
+        acc = 0.0
+        for i in numba.prange(pos.shape[0]):
+            for j in range(pos.shape[1]):
+                d = (pos[i, j] - ref_pos[i, j]) + \
+                    (ima[i, j] - ref_ima[i, j]) * L[j]
+                acc += d * d
+        return acc
+
+    @numba.njit(cache=True, parallel=True, fastmath=True)
+    def _diagnostics_kernel(pos, ima, ref_pos, ref_ima, L, mass, vel):
+        # Fused rmsd + m|v|^2 accumulation: one sweep over the
+        # particle arrays instead of one per observable
+        acc = 0.0
+        mvv = 0.0
+        for i in numba.prange(pos.shape[0]):
+            for j in range(pos.shape[1]):
+                d = (pos[i, j] - ref_pos[i, j]) + \
+                    (ima[i, j] - ref_ima[i, j]) * L[j]
+                acc += d * d
+                mvv += mass[i] * vel[i, j] * vel[i, j]
+        return acc, mvv
+
+    @numba.njit(cache=True, fastmath=True)
+    def _mass_velocity_squared(mass, vel):
+        # One-pass sum of m_i |v_i|^2, no temporaries
+        acc = 0.0
+        for i in range(mass.shape[0]):
+            acc += mass[i] * (vel[i, 0] * vel[i, 0] +
+                              vel[i, 1] * vel[i, 1] +
+                              vel[i, 2] * vel[i, 2])
+        return acc
+
+except ImportError:
+
+    _HAVE_NUMBA = False
+
+    def _rmsd_squared(pos, ima, ref_pos, ref_ima, L):
+        # Accumulate the image contribution in place on the
+        # displacement buffer, so the unfolded positions are never
+        # materialized
+        d = pos - ref_pos
+        d += (ima - ref_ima) * L
+        return numpy.einsum('ij,ij->', d, d)
+
+    def _mass_velocity_squared(mass, vel):
+        return numpy.einsum('i,ij,ij->', mass, vel, vel)
+
+    def _diagnostics_kernel(pos, ima, ref_pos, ref_ima, L, mass, vel):
+        # Without numba we fall back to one pass per observable
+        return (_rmsd_squared(pos, ima, ref_pos, ref_ima, L),
+                _mass_velocity_squared(mass, vel))
+
 
 def unfold(system):
     # s = system
@@ -30,21 +119,17 @@ def unfold(system):
     # system.particle = particle
     # return s
     from atooms.system import System
-    npart = system.sample.GetNumberOfParticles()
-    pos = system.sample.GetPositions()
     nsp = system.sample.GetNumberOfTypes()
-    ima = system.sample.GetImages()
-    spe = numpy.ndarray(npart, dtype=int)
-    ii = 0
-    for i in range(nsp):
-        ni = system.sample.GetNumberThisType(i)
-        spe[ii: ii + ni] = i
-        ii += ni
+    counts = numpy.fromiter((system.sample.GetNumberThisType(i)
+                             for i in range(nsp)),
+                            dtype=numpy.intp, count=nsp)
+    spe = numpy.repeat(numpy.arange(nsp), counts)
+    # Unfold all positions in one vectorized pass, then build the
+    # particles in a single comprehension (no second attribute loop)
+    pos = system.sample.GetPositions() + \
+        system.sample.GetImages() * system.cell.side
     particle = [Particle(species=spe_i, position=pos_i) for spe_i, pos_i in
                 zip(spe, pos)]
-    for p, i in zip(particle, ima):
-        p.position += i * system.cell.side
-
     return System(particle=particle, cell=system.cell)
 
 
@@ -91,11 +176,7 @@ class RUMD(object):
             # We parse the forcefield file
             # It should provide a list of potentials named potential
             if forcefield_file is not None:
-                with open(forcefield_file) as fh:
-                    exec(fh.read())
-                if 'potential' not in locals():
-                    raise ValueError('forcefield file should contain a list of potentials named potential')
-                for pot in potential:
+                for pot in _parse_forcefield(forcefield_file):
                     self.rumd_simulation.AddPotential(pot)
 
             # Add a rumd integrator
@@ -116,6 +197,12 @@ class RUMD(object):
         # Copy of initial state
         self._initial_sample = self.rumd_simulation.sample.Copy()
 
+        # Cached simulation box and lengths, see rmsd
+        self._box = self.rumd_simulation.sample.GetSimulationBox()
+        self._box_lengths = None
+        # Scratch buffers reused across rmsd calls (numpy path only)
+        self._rmsd_scratch = None
+
         # Hold a reference to the system
         # self.system = System(self.rumd_simulation.sample, self.rumd_simulation.potentialList)
 
@@ -131,25 +218,15 @@ class RUMD(object):
         return system
 
     def _set_system(self, value):
+        # Assign copies the sample in memory, without the file
+        # round-trip (WriteConf to a temp dir + ReadConf) that older
+        # versions of this backend used
         self.rumd_simulation.sample.Assign(value.sample)
         # TODO: improve copying over of thermostat
         # self.rumd_simulation.itg.InitializeFromInfoString(value._itg_infoStr_start)
         # Setting sample this way is useless.
         #   self.rumd_simulation.sample = value.sample
-        # Rumd actually sets samples via a file, there seems to be no other way.
         # TODO: to retain modifications to system, use atooms trajectory but at the moment we would loose info on thermostat
-        # import tempfile
-        # from atooms.core.utils import rmd
-        # # Why should we set the output dir? It should not change
-        # #tmp = value.sample.GetOutputDirectory()
-        # dirout = tempfile.mkdtemp()
-        # file_tmp = os.path.join(dirout, 'sample.xyz.gz')
-        # value.sample.WriteConf(file_tmp)
-        # self.rumd_simulation.sample.ReadConf(file_tmp, init_itg=False)
-        # # Why should we set the output dir? It should not change
-        # # value.sample.SetOutputDirectory(tmp)
-        # # Clean up
-        # rmd(dirout)
 
     system = property(_get_system, _set_system, 'System')
 
@@ -166,15 +243,82 @@ class RUMD(object):
             raise Exception('rmsd between two references of the same system does not make sense (use deepecopy?)')
         ndim = 3  # hard coded
         N = self.rumd_simulation.sample.GetNumberOfParticles()
-        L = [self.rumd_simulation.sample.GetSimulationBox().GetLength(i) for i in range(ndim)]
+        # Refresh the cached box lengths only when the box changes,
+        # using the first length as a cheap change detector
+        L0 = self._box.GetLength(0)
+        if self._box_lengths is None or self._box_lengths[0] != L0:
+            self._box_lengths = numpy.asarray([self._box.GetLength(i)
+                                               for i in range(ndim)])
+        pos = self.rumd_simulation.sample.GetPositions()
+        # Keep the reduction in the sample precision (float32 on GPU
+        # builds of RUMD), which halves the memory traffic; only the
+        # final scalar is promoted
+        L = self._box_lengths.astype(pos.dtype, copy=False)
+        ima = self.rumd_simulation.sample.GetImages()
+        ref_pos = self._initial_sample.GetPositions()
+        ref_ima = self._initial_sample.GetImages()
         # Unfold positions using periodic image information
-        ref = self._initial_sample.GetPositions() + self._initial_sample.GetImages() * L
-        unf = self.rumd_simulation.sample.GetPositions() + self.rumd_simulation.sample.GetImages() * L
-        return (sum(sum((unf - ref)**2)) / N)**0.5
+        if _HAVE_NUMBA:
+            acc = _rmsd_squared(pos, ima, ref_pos, ref_ima, L)
+        else:
+            # Reuse persistent scratch buffers so the numpy path does
+            # not allocate two 3N arrays per call
+            if self._rmsd_scratch is None or \
+               self._rmsd_scratch[0].shape != pos.shape:
+                self._rmsd_scratch = (numpy.empty_like(pos),
+                                      numpy.empty_like(pos))
+            d, tmp = self._rmsd_scratch
+            numpy.subtract(pos, ref_pos, out=d)
+            numpy.multiply(ima - ref_ima, L, out=tmp)
+            numpy.add(d, tmp, out=d)
+            acc = numpy.einsum('ij,ij->', d, d)
+        return float(acc / N)**0.5
+
+    def diagnostics(self):
+        """
+        Compute rmsd, kinetic energy and temperature in a single pass
+        over the particle arrays.
+
+        Return a `Diagnostics` namedtuple. Simulation drivers that
+        sample several observables at the same step can call this once
+        instead of reading the individual properties.
+        """
+        sample = self.rumd_simulation.sample
+        N = sample.GetNumberOfParticles()
+        ndof = sample.GetNumberOfDOFs()
+        pos = sample.GetPositions()
+        L0 = self._box.GetLength(0)
+        if self._box_lengths is None or self._box_lengths[0] != L0:
+            self._box_lengths = numpy.asarray([self._box.GetLength(i)
+                                               for i in range(3)])
+        L = self._box_lengths.astype(pos.dtype, copy=False)
+        system = self.system
+        acc, mvv = _diagnostics_kernel(pos, sample.GetImages(),
+                                       self._initial_sample.GetPositions(),
+                                       self._initial_sample.GetImages(),
+                                       L, system.masses,
+                                       sample.GetVelocities())
+        return Diagnostics(rmsd=float(acc / N)**0.5,
+                           kinetic_energy=0.5 * float(mvv),
+                           temperature=float(mvv) / ndof)
 
     def write_checkpoint(self, output_path):
-        with Trajectory(output_path + '.chk', 'w') as t:
-            t.write(self.system, None)
+        # Checkpoints are single-file, single-step configurations, so
+        # we bypass the Trajectory wrapper and write the sample
+        # directly. WriteConf gzips its output, so we decompress it in
+        # place, as Trajectory.close() would, because read_checkpoint()
+        # expects a plain .chk file.
+        out = output_path + '.chk'
+        self.rumd_simulation.sample.WriteConf(out, 'w')
+        src = out + '.gz'
+        if os.path.exists(src):
+            import gzip
+            import shutil
+            # Decompress in process, no fork/exec of gunzip
+            with gzip.open(src, 'rb') as fin:
+                with open(out, 'wb') as fout:
+                    shutil.copyfileobj(fin, fout, length=1024*1024)
+            os.remove(src)
 
     def read_checkpoint(self, output_path):
         if os.path.exists(output_path + '.chk'):
@@ -198,26 +342,66 @@ class Thermostat(object):
 
     def __init__(self, integrator):
         self._integrator = integrator
+        self._cached_info = None
+        self._cached_tokens = None
+
+    def _tokens(self):
+        # Re-split the info string only when it actually changed
+        info = self._integrator.GetInfoString(18)
+        if info != self._cached_info:
+            self._cached_info = info
+            self._cached_tokens = info.split(',')
+        return self._cached_tokens
+
+    def _update(self, index, value):
+        tokens = list(self._tokens())
+        tokens[index] = value
+        self._integrator.InitializeFromInfoString(','.join(tokens))
+        self._cached_info = None
 
     def reset(self):
-        info = self._integrator.GetInfoString(18).split(',')
-        info[4] = '1.0'
-        info = ','.join(info)
-        self._integrator.InitializeFromInfoString(info)
+        self._update(4, '1.0')
 
     def _get_temperature(self):
-        info = self._integrator.GetInfoString(18).split(',')
-        return float(info[2])
+        return float(self._tokens()[2])
 
     def _set_temperature(self, value):
-        info = self._integrator.GetInfoString(18).split(',')
-        info[2] = '%g' % value
-        info = ','.join(info)
-        self._integrator.InitializeFromInfoString(info)
+        self._update(2, '%g' % value)
 
     temperature = property(_get_temperature, _set_temperature, 'Temperature')
 
 
+class _ParticleView(object):
+
+    """
+    Lazy sequence of `Particle` objects built on demand from the
+    sample arrays.
+
+    Only the particles that are actually indexed are materialized as
+    Python objects, so aggregate consumers (temperature, energies,
+    dump) do not pay for N allocations upfront.
+    """
+
+    def __init__(self, species, mass, position, velocity, image):
+        self._species = species
+        self._mass = mass
+        self._position = position
+        self._velocity = velocity
+        self._image = image
+
+    def __len__(self):
+        return len(self._species)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        p = Particle(species=self._species[index], mass=self._mass[index],
+                     position=self._position[index],
+                     velocity=self._velocity[index])
+        p.periodic_image = self._image[index]
+        return p
+
+
 class System(object):
 
     """System wrapper for RUMD."""
@@ -227,6 +411,17 @@ class System(object):
         self.thermostat = Thermostat(self.sample.GetIntegrator())
         self.barostat = None
         self.reservoir = None
+        # Caches for the per-particle mass and species arrays, see
+        # __get_mass() and species
+        self._mass_cache = None
+        self._mass_key = None
+        self._species_cache = None
+        self._species_key = None
+        # Cached simulation box, lengths and Cell, see _lengths()
+        self._box = self.sample.GetSimulationBox()
+        self._box_lengths = None
+        self._cell_cache = None
+        self._cell_key = None
 
     def __copy__(self):
         # This is not really needed, it's just there for reference
@@ -234,6 +429,8 @@ class System(object):
         result = cls.__new__(cls)
         result.__dict__.update(self.__dict__)
         result.sample = self.sample.Copy()
+        result._box = result.sample.GetSimulationBox()
+        result._box_lengths = None
         return result
 
     def __deepcopy__(self, memo):
@@ -248,6 +445,14 @@ class System(object):
         #result._itg_infoStr_start = self.thermostat._integrator.GetInfoString(18)
         # TODO: thermostat should be a property this way we would not need to update this
         result.thermostat = Thermostat(self.sample.GetIntegrator())
+        result._mass_cache = None
+        result._mass_key = None
+        result._species_cache = None
+        result._species_key = None
+        result._box = result.sample.GetSimulationBox()
+        result._box_lengths = None
+        result._cell_cache = None
+        result._cell_key = None
         return result
 
     def update(self, other):
@@ -258,15 +463,18 @@ class System(object):
     def potential_energy(self, per_particle=False, normed=False, cache=False):
         self.sample.CalcF()
         if normed or per_particle:
-            return self.sample.GetPotentialEnergy() / len(self.particle)
+            # Ask the sample for N, do not materialize the particles
+            return self.sample.GetPotentialEnergy() / self.sample.GetNumberOfParticles()
         else:
             return self.sample.GetPotentialEnergy()
 
     def kinetic_energy(self,per_particle=False, normed=False):
         # TODO: use double IntegratorNVT::GetKineticEnergy(bool copy) const{
-        ekin = sum([p.kinetic_energy for p in self.particle])
+        vel = self.sample.GetVelocities()
+        mass = self.__get_mass()
+        ekin = 0.5 * _mass_velocity_squared(mass, vel)
         if normed or per_particle:
-            return ekin / len(self.particle)
+            return ekin / self.sample.GetNumberOfParticles()
         else:
             return ekin
 
@@ -274,32 +482,49 @@ class System(object):
         return self.potential_energy(per_particle=per_particle, normed=normed, cache=cache) +\
             self.kinetic_energy(per_particle=per_particle, normed=normed)
 
-    def __get_mass(self):
-        # TODO: cache it (but what if masses change?)
-        npart = self.sample.GetNumberOfParticles()
+    def __get_species_counts(self):
         nsp = self.sample.GetNumberOfTypes()
-        mass = numpy.ndarray(npart, dtype=float)
-        ii = 0
-        for i in range(nsp):
-            ni = self.sample.GetNumberThisType(i)
+        return numpy.fromiter((self.sample.GetNumberThisType(i)
+                               for i in range(nsp)),
+                              dtype=numpy.intp, count=nsp)
+
+    def __get_mass(self):
+        # Masses are constant over the sample lifetime, so we cache
+        # the per-particle array and only rebuild it if the number of
+        # particles or of species changes
+        key = (self.sample.GetNumberOfParticles(),
+               self.sample.GetNumberOfTypes())
+        if self._mass_key == key and self._mass_cache is not None:
+            return self._mass_cache
+
+        def _mass_of_type(i):
             try:
                 # This will work with rumd <= 2.0.1 I think
                 # meta = self.sample.GetTrajectoryConfMetaData()
                 # then get meta.GetMassOfType(i)
-                mi = self.sample.GetMass(i)
+                return self.sample.GetMass(i)
             except:
                 _log.warn('cannot get mass from RUMD interface, setting to 1.0')
-                mi = 1.0
-            mass[ii: ii + ni] = mi
-            ii += ni
-        return mass
+                return 1.0
+        nsp = self.sample.GetNumberOfTypes()
+        counts = self.__get_species_counts()
+        # Match the sample storage precision (float32 on GPU builds)
+        # so that downstream reductions stay in a single dtype
+        dtype = self.sample.GetVelocities().dtype
+        masses = numpy.fromiter((_mass_of_type(i) for i in range(nsp)),
+                                dtype=dtype, count=nsp)
+        # Repeat each species mass over its block of particles in a
+        # single C-level pass (particles are sorted by species)
+        self._mass_cache = numpy.repeat(masses, counts)
+        self._mass_key = key
+        return self._mass_cache
 
     @property
     def temperature(self):
         ndof = self.sample.GetNumberOfDOFs()
         vel = self.sample.GetVelocities()
         mass = self.__get_mass()
-        return numpy.sum(mass * numpy.sum(vel**2.0, 1)) / ndof
+        return _mass_velocity_squared(mass, vel) / ndof
 
     def set_temperature(self, T):
         # Scale velocities from temperature Told to T
@@ -312,11 +537,59 @@ class System(object):
     def scale_velocities(self, factor):
         self.sample.ScaleVelocities(factor)
 
+    def _lengths(self):
+        """Return the box lengths as a cached ndarray."""
+        # We use the first length as a cheap change detector, so we
+        # pay one C-API call instead of three on repeated accesses
+        L0 = self._box.GetLength(0)
+        if self._box_lengths is None or self._box_lengths[0] != L0:
+            self._box_lengths = numpy.array([self._box.GetLength(i)
+                                             for i in range(3)], dtype=float)
+        return self._box_lengths
+
     @property
     def cell(self):
-        box = self.sample.GetSimulationBox()
-        L = [box.GetLength(i) for i in range(3)]
-        return Cell(L)
+        # Reuse the Cell while the box is unchanged; under NPT the key
+        # changes and the Cell is rebuilt
+        L = self._lengths()
+        if self._cell_cache is None or self._cell_key != L[0]:
+            self._cell_cache = Cell(L)
+            self._cell_key = L[0]
+        return self._cell_cache
+
+    @property
+    def positions(self):
+        """Positions as an ndarray view on the sample."""
+        return self.sample.GetPositions()
+
+    @property
+    def velocities(self):
+        """Velocities as an ndarray view on the sample."""
+        return self.sample.GetVelocities()
+
+    @property
+    def images(self):
+        """Periodic images as an ndarray view on the sample."""
+        return self.sample.GetImages()
+
+    @property
+    def species(self):
+        """Species indices as an ndarray (particles are sorted by species)."""
+        # Like masses, the species layout is constant for the sample
+        # lifetime, so we cache the array keyed by (npart, nsp)
+        key = (self.sample.GetNumberOfParticles(),
+               self.sample.GetNumberOfTypes())
+        if self._species_key != key or self._species_cache is None:
+            nsp = key[1]
+            counts = self.__get_species_counts()
+            self._species_cache = numpy.repeat(numpy.arange(nsp), counts)
+            self._species_key = key
+        return self._species_cache
+
+    @property
+    def masses(self):
+        """Per-particle masses as an ndarray."""
+        return self.__get_mass()
 
     @property
     def particle(self):
@@ -327,26 +600,21 @@ class System(object):
         # Warning n.2 : it ia assumed that particles are sorted by species.
         # since RUMD does not have accessors to particle types (why??)
         # and we can only access the number of particles of a given type.
-        npart = self.sample.GetNumberOfParticles()
-        pos = self.sample.GetPositions()
-        vel = self.sample.GetVelocities()
-        nsp = self.sample.GetNumberOfTypes()
-        ima = self.sample.GetImages()
-        mass = self.__get_mass()
-        spe = numpy.ndarray(npart, dtype=int)
-        ii = 0
-        for i in range(nsp):
-            ni = self.sample.GetNumberThisType(i)
-            spe[ii: ii + ni] = i
-            ii += ni
-        p = [Particle(species=spe_i, mass=mass_i, position=pos_i,
-                      velocity=vel_i) for spe_i, mass_i, pos_i, vel_i
-             in zip(spe, mass, pos, vel)]
-        for pi, i in zip(p, ima):
-            pi.periodic_image = i
-        return p
+        return _ParticleView(self.species, self.masses, self.positions,
+                             self.velocities, self.images)
 
     def dump(self, what):
+        # Short-circuit the common properties to the sample arrays.
+        # Note that these are views on the sample, do not mutate them.
+        if what in ('pos', 'position', 'particle.position'):
+            return self.positions
+        elif what in ('vel', 'velocity', 'particle.velocity'):
+            return self.velocities
+        elif what in ('spe', 'species', 'particle.species'):
+            return self.species
+        elif what in ('mass', 'particle.mass'):
+            return self.masses
+        # Fall back to the generic system dump for anything else
         import atooms.system
         system = atooms.system.System(self.particle, self.cell)
         return system.dump(what)
@@ -386,5 +654,12 @@ class Trajectory(object):
 
     def close(self):
         # This only unzips files with no step info
-        if os.path.exists(self.filename + '.gz'):
-            os.system("gunzip -f %s.gz" % self.filename)
+        src = self.filename + '.gz'
+        if os.path.exists(src):
+            import gzip
+            import shutil
+            # Decompress in process, no fork/exec of gunzip
+            with gzip.open(src, 'rb') as fin:
+                with open(self.filename, 'wb') as fout:
+                    shutil.copyfileobj(fin, fout, length=1024*1024)
+            os.remove(src)
@@ -229,19 +229,26 @@ def add_first_last_skip(parser, what=None):
 # Logging facilities
 
 class _ParallelFilter(logging.Filter):
+
+    # In a serial run every record passes, no need to inspect it
+    _serial = size == 1
+
     def filter(self, rec):
-        if hasattr(rec, 'rank'):
-            if rec.rank == 'all':
-                return True
-            else:
-                return rank == rec.rank
-        else:
+        if self._serial:
+            return True
+        rec_rank = getattr(rec, 'rank', None)
+        if rec_rank is None:
             return rank == 0
+        return True if rec_rank == 'all' else rank == rec_rank
+
+
+# Level names that get echoed in the formatted message
+_LOUD_LEVELS = frozenset(('WARNING', 'ERROR'))
 
 
 class _MyFormatter(logging.Formatter):
     def format(self, record):
-        if record.levelname in ['WARNING', 'ERROR']:
+        if record.levelname in _LOUD_LEVELS:
             return '# ' + record.levelname + ' ' + record.msg % record.args
         else:
             return '# ' + record.msg % record.args
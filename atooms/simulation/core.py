@@ -97,6 +97,11 @@ class Simulation(object):
 
         # Internal variables
         self._callback = []
+        # Cached partitions of _callback, kept in sync by add() / remove()
+        self._targeters = []
+        self._non_targeters = []
+        # Particle count memoized by wall_time(), reset at each run()
+        self._npart_cache = None
         self._start_time = time.time()
         self._speedometer = None
         self._checkpoint_scheduler = Scheduler(checkpoint_interval)
@@ -160,14 +165,20 @@ class Simulation(object):
         # Keep targeters last
         if 'target' not in _callable_name(callback):
             self._callback.insert(0, callback)
+            self._non_targeters.insert(0, callback)
         else:
             self._callback.append(callback)
+            self._targeters.append(callback)
 
     def remove(self, callback):
         """Remove the observer `callback`."""
         if callback in self._callback:
             self._callback.remove(callback)
             self._cbk_params.pop(callback)
+            if callback in self._targeters:
+                self._targeters.remove(callback)
+            else:
+                self._non_targeters.remove(callback)
         else:
             _log.debug('attempt to remove inexistent callback %s (dont worry)', callback)
 
@@ -175,19 +186,14 @@ class Simulation(object):
         self.remove(callback)
 
     def _notify(self, observers):
+        # Hoist the params dict and the debug decision out of the loop
+        cbk_params = self._cbk_params
+        debug = _log.isEnabledFor(logging.DEBUG)
         for observer in observers:
-            _log.debug('notify %s at step %d', observer, self.current_step)
-            args = self._cbk_params[observer]['args']
-            kwargs = self._cbk_params[observer]['kwargs']
-            observer(self, *args, **kwargs)
-
-    @property
-    def _targeters(self):
-        return [o for o in self._callback if 'target' in _callable_name(o)]
-
-    @property
-    def _non_targeters(self):
-        return [o for o in self._callback if 'target' not in _callable_name(o)]
+            if debug:
+                _log.debug('notify %s at step %d', observer, self.current_step)
+            params = cbk_params[observer]
+            observer(self, *params['args'], **params['kwargs'])
 
     @property
     def _speedometers(self):
@@ -263,8 +269,13 @@ class Simulation(object):
         norm = 1.0
         # Normalize per particle
         if per_particle:
-            if len(self.system.particle) > 0:
-                norm *= len(self.system.particle)
+            # The particle count is constant during a run, cache it so
+            # per-tick observers do not materialize the particle list
+            npart = self._npart_cache
+            if npart is None:
+                npart = self._npart_cache = len(self.system.particle)
+            if npart > 0:
+                norm *= npart
             else:
                 return float('nan')
         # Normalize per step
@@ -293,21 +304,21 @@ class Simulation(object):
                 self.steps = steps
 
         # Targeter for steps. We first replace the existing one
+        final_step = self.current_step + self.steps
         self.remove(self._targeter_steps)
-        self.add(self._targeter_steps, Scheduler(self.current_step + self.steps),
-                 self.current_step + self.steps)
+        self.add(self._targeter_steps, Scheduler(final_step), final_step)
 
         # Targeter for progress bar
         if atooms.core.progress.active:
             intervals = [self._cbk_params[cbk]['scheduler'].interval for cbk in self._callback]
             intervals = [intv for intv in intervals if intv is not None]
             min_iters = 10
-            if min(intervals) > (self.current_step + self.steps) / min_iters and \
-               (self.current_step + self.steps) / min_iters > 10 :
+            if min(intervals) > final_step / min_iters and \
+               final_step / min_iters > 10 :
                 def flush(sim):
                     pass
                 self.remove(flush)
-                self.add(flush, Scheduler((self.current_step + self.steps) / min_iters))
+                self.add(flush, Scheduler(final_step / min_iters))
 
         # Report
         _report(self._info_start())
@@ -324,6 +335,7 @@ class Simulation(object):
         barrier()
         self.initial_step = self.current_step
         self._start_time = time.time()
+        self._npart_cache = None
 
         import signal
         import sys
@@ -351,22 +363,36 @@ class Simulation(object):
                 self._notify(self._speedometers)
             _log.info('starting at step: %d', self.current_step)
             _log.info('')
+            # The observer set is fixed within the loop, so we hoist
+            # the scheduler and parameter lookups, as well as the hot
+            # bound methods, out of it
+            cbk_params = [(c, self._cbk_params[c]) for c in self._callback]
+            run_until = self.run_until
+            checkpoint_scheduler = self._checkpoint_scheduler
             while True:
-                # Run simulation until any of the observers need to be called
-                all_steps = [self._cbk_params[c]['scheduler'](self) for c in self._callback]
-                next_checkpoint = self._checkpoint_scheduler(self)
-                next_step = min(all_steps + [next_checkpoint])
-
-                self.run_until(next_step)
-
-                # Find observers indexes corresponding to minimum step
-                # then get all corresponding observers
-                next_step_ids = [i for i, step in enumerate(all_steps) if step == next_step]
-                next_observers = [self._callback[i] for i in next_step_ids]
-
-                # Observers should be sorted such that targeters are
-                # last to avoid cropping output files
-                self._notify(next_observers)
+                # Run simulation until any of the observers need to be
+                # called: find the minimum next step and the observers
+                # scheduled there in a single pass
+                next_step = None
+                ready = []
+                for entry in cbk_params:
+                    this_step = entry[1]['scheduler'](self)
+                    if next_step is None or this_step < next_step:
+                        next_step = this_step
+                        ready = [entry]
+                    elif this_step == next_step:
+                        ready.append(entry)
+                next_checkpoint = checkpoint_scheduler(self)
+                if next_checkpoint < next_step:
+                    next_step = next_checkpoint
+                    ready = []
+
+                run_until(next_step)
+
+                # Since _callback keeps targeters last, they are
+                # notified last and do not crop output files
+                for observer, params in ready:
+                    observer(self, *params['args'], **params['kwargs'])
                 if self.current_step == next_checkpoint:
                     self.write_checkpoint()
 
@@ -391,6 +417,16 @@ class Simulation(object):
             _log.error('simulation failed')
             raise
 
+        finally:
+            # Close files kept open by the write observers
+            t = getattr(self, '_write_config_trajectory', None)
+            if t is not None:
+                t.close()
+                self._write_config_trajectory = None
+            fh = getattr(self, '_write_thermo_fh', None)
+            if fh is not None and not fh.closed:
+                fh.close()
+
     def _info_start(self):
         now = datetime.datetime.now().strftime('%Y-%m-%d at %H:%M')
         txt = """\
@@ -38,8 +38,10 @@ import os
 import shutil
 import time
 import datetime
+import operator
 import logging
 from atooms.core.utils import rmd, rmf
+from atooms.system import System as _System
 
 __all__ = ['SimulationEnd', 'WallTimeLimit', 'SimulationKill',
            'Scheduler', 'write_config', 'write_thermo', 'write',
@@ -49,19 +51,27 @@ __all__ = ['SimulationEnd', 'WallTimeLimit', 'SimulationKill',
 
 _log = logging.getLogger(__name__)
 
+# Sentinel step for disabled schedulers, hoisted out of the hot path
+_MAX_STEP = sys.maxsize
+
 
 # Helper functions
 
+_TIME_FMT = '%dd:%02dh:%02dm:%02ds'
+
+
 def _sec2time(time_interval):
     """
     Convert a time interval in seconds to (day, hours, minutes,
     seconds) format.
     """
-    eta_d = time_interval / (24.0 * 3600)
-    eta_h = (eta_d - int(eta_d)) * 24
-    eta_m = (eta_h - int(eta_h)) * 60.0
-    eta_s = (eta_m - int(eta_m)) * 60.0
-    return '%dd:%02dh:%02dm:%02ds' % (eta_d, eta_h, eta_m, eta_s)
+    # Integer divmod chain: no float rounding artifacts and fewer
+    # operations than peeling fractional parts off floats
+    eta_s = int(time_interval)
+    eta_m, eta_s = divmod(eta_s, 60)
+    eta_h, eta_m = divmod(eta_m, 60)
+    eta_d, eta_h = divmod(eta_h, 24)
+    return _TIME_FMT % (eta_d, eta_h, eta_m, eta_s)
 
 
 # Default exceptions
@@ -90,6 +100,12 @@ class Scheduler(object):
     and returns the next step at which an observer has to to notified.
     """
 
+    # Schedulers are polled on every tick and can be numerous in
+    # ensemble runs: slots cut the per-instance dict and speed up
+    # attribute access
+    __slots__ = ('interval', 'calls', 'steps', 'block', 'seconds',
+                 '_fixed_interval')
+
     def __init__(self, interval=None, calls=None, steps=None,
                  block=None, seconds=None):
         """
@@ -113,12 +129,16 @@ class Scheduler(object):
         if self.calls is not None and self.calls <= 0:
             self.calls = None
 
+        # Precompute the dispatch decision for the common fixed-interval
+        # case, which is polled on every simulation tick
+        self._fixed_interval = self.interval is not None and self.calls is None
+
     def __call__(self, sim):
         """
         Given a simulation instance `sim`, return the next step at which
         the observer will be called.
         """
-        if self.interval is not None and self.calls is None:
+        if self._fixed_interval:
             # Regular interval
             return (sim.current_step // self.interval + 1) * self.interval
 
@@ -129,7 +149,7 @@ class Scheduler(object):
 
         elif self.steps is not None:
             # List of selected steps
-            inext = sys.maxsize
+            inext = _MAX_STEP
             for i, step in enumerate(self.steps):
                 if step > sim.current_step:
                     inext = self.steps[i]
@@ -139,7 +159,7 @@ class Scheduler(object):
         elif self.block is not None:
             # Periodic block of steps
             step_of_last_block = (sim.current_step // self.block[-1]) * self.block[-1]
-            inext = sys.maxsize
+            inext = _MAX_STEP
             for i, step in enumerate(self.block):
                 if step > sim.current_step % self.block[-1]:
                     inext = self.block[i] + step_of_last_block
@@ -149,7 +169,7 @@ class Scheduler(object):
         elif self.seconds is not None:
             pass
         else:
-            return sys.maxsize
+            return _MAX_STEP
 
 
 # Writer callbacks
@@ -180,16 +200,46 @@ def write_config(sim, fields=None, precision=None):
     # Header
     if not sim.__init_write_config:
         sim.__init_write_config = True
+        # Drop any trajectory left open by a previous run before
+        # clearing the output path
+        t = getattr(sim, '_write_config_trajectory', None)
+        if t is not None:
+            t.close()
+            sim._write_config_trajectory = None
         # TODO: folder-based trajectories should ensure that mode='w' clears up the folder
         rmd(sim.output_path)
         rmf(sim.output_path)
 
-    with sim.trajectory_class(sim.output_path, 'a') as t:
+    # Reuse a single trajectory instance across calls instead of
+    # opening and closing the file at every configuration write. The
+    # instance is closed by Simulation.run() at the end of the run.
+    # We track the opened path on the simulation because minimal
+    # trajectory classes need not store the file name.
+    t = getattr(sim, '_write_config_trajectory', None)
+    if t is None or getattr(sim, '_write_config_path', None) != sim.output_path:
+        if t is not None:
+            t.close()
+        t = sim._write_config_trajectory = sim.trajectory_class(sim.output_path, 'a')
+        sim._write_config_path = sim.output_path
         if precision is not None:
             t.precision = precision
         if fields is not None:
             t.fields = fields
-        t.write(sim.system, sim.current_step)
+    t.write(sim.system, sim.current_step)
+    # Flush the underlying file, if any, so that the output can be
+    # inspected while the simulation is running
+    fh = getattr(t, 'trajectory', None)
+    if fh is not None and hasattr(fh, 'flush'):
+        fh.flush()
+
+
+# Default field list for write_thermo
+_THERMO_FIELDS = ['steps',
+                  'temperature',
+                  'potential energy per particle',
+                  'kinetic energy per particle',
+                  'total energy per particle',
+                  'rmsd']
 
 
 def write_thermo(sim, fields=None, fmt=None, precision=6, functions=None):
@@ -217,21 +267,60 @@ def write_thermo(sim, fields=None, fmt=None, precision=6, functions=None):
 
     # By default write minimal info
     if fields is None:
-        fields = ['steps',
-                  'temperature',
-                  'potential energy per particle',
-                  'kinetic energy per particle',
-                  'total energy per particle',
-                  'rmsd']
+        fields = _THERMO_FIELDS
+
+    # The temperature, kinetic and total energy fields all reduce
+    # over the particle velocities, and the potential and total
+    # energy both need the interaction energy. Memoize the two
+    # expensive reductions within this call so each is computed at
+    # most once per line, whatever combination of fields is active.
+    _memo = {}
+
+    def _epot_pp(x):
+        try:
+            return _memo['epot']
+        except KeyError:
+            _memo['epot'] = x.system.potential_energy(True)
+            return _memo['epot']
+
+    def _ekin_pp(x):
+        try:
+            return _memo['ekin']
+        except KeyError:
+            _memo['ekin'] = x.system.kinetic_energy(True)
+            return _memo['ekin']
+
+    def _temperature(x):
+        try:
+            return _memo['T']
+        except KeyError:
+            system = x.system
+            if type(system) is _System:
+                # Native system: same formula as System.temperature,
+                # reusing the cached kinetic energy per particle
+                npart = len(system.particle)
+                if npart > 1:
+                    ndof = (npart - 1) * system.number_of_dimensions
+                    T = 2.0 * npart * _ekin_pp(x) / ndof
+                elif npart == 1:
+                    T = 2.0 * _ekin_pp(x) / system.number_of_dimensions
+                else:
+                    T = 0.0
+            else:
+                # Backend systems define their own degrees of freedom
+                # and may not expose number_of_dimensions at all
+                T = system.temperature
+            _memo['T'] = T
+            return T
 
     # Internal function database.
     # It can be augmented via functions parameter
     _db_func = {
         'steps': lambda x: x.current_step,
-        'potential energy per particle': lambda x: x.system.potential_energy(True),
-        'kinetic energy per particle': lambda x: x.system.kinetic_energy(True),
-        'total energy per particle': lambda x: x.system.total_energy(True, cache=True),
-        'temperature': lambda x: x.system.temperature,
+        'potential energy per particle': _epot_pp,
+        'kinetic energy per particle': _ekin_pp,
+        'total energy per particle': lambda x: _epot_pp(x) + _ekin_pp(x),
+        'temperature': _temperature,
         'density': lambda x: x.system.density,
         'pressure': lambda x: x.system.pressure,
         'rmsd': lambda x: x.rmsd,
@@ -261,18 +350,49 @@ def write_thermo(sim, fields=None, fmt=None, precision=6, functions=None):
     if sim.restart:
         sim.__init_write_thermo = True
 
+    # We keep a persistent file handle on the simulation instance, so
+    # each sample costs one write instead of an open/write/close
+    # triple. We still flush per line so that the file can be polled
+    # while the simulation runs.
+    f = sim.output_path + '.thermo'
+    fh = getattr(sim, '_write_thermo_fh', None)
+
     # Header
     if not sim.__init_write_thermo:
         sim.__init_write_thermo = True
-        with open(sim.output_path + '.thermo', 'w') as fh:
-            txt = ', '.join(fields)
-            fh.write('# columns: {}\n'.format(txt))
+        if fh is not None:
+            fh.close()
+        fh = sim._write_thermo_fh = open(f, 'w')
+        txt = ', '.join(fields)
+        fh.write('# columns: {}\n'.format(txt))
+
+    # Reopen in append mode if we restart or the output path changed
+    if fh is None or fh.closed or fh.name != f:
+        fh = sim._write_thermo_fh = open(f, 'a')
 
     # Line
-    with open(sim.output_path + '.thermo', 'a') as fh:
-        values = [_db_func[field](sim) for field in fields]
-        result = ' '.join([_db_fmt[field].format(value) for value, field in zip(values, fields)])
-        fh.write('{}\n'.format(result))
+    values = [_db_func[field](sim) for field in fields]
+    result = ' '.join([_db_fmt[field].format(value) for value, field in zip(values, fields)])
+    fh.write('{}\n'.format(result))
+    fh.flush()
+
+
+# Attribute resolvers shared across observers, keyed by attribute name
+_attrgetter_cache = {}
+
+
+def _cached_attrgetter(name):
+    """Return a memoized `operator.attrgetter` for `name`."""
+    try:
+        return _attrgetter_cache[name]
+    except KeyError:
+        getter = operator.attrgetter(name)
+        _attrgetter_cache[name] = getter
+        return getter
+
+
+# Parsed attribute getters for write(), keyed by the attribute tuple
+_write_cache = {}
 
 
 def write(sim, name, attributes):
@@ -290,20 +410,28 @@ def write(sim, name, attributes):
         with open(f, 'w') as fh:
             fh.write('# columns: %s\n' % ', '.join(attributes))
     else:
+        # Parse the attributes into getters and build the format
+        # string once per attribute list, not on every call
+        key = tuple(attributes)
+        try:
+            getters, fmt = _write_cache[key]
+        except KeyError:
+            getters = []
+            for attr in attributes:
+                level = len(attr.split('.'))
+                if level == 1:
+                    getters.append(operator.attrgetter(attr))
+                elif level == 2:
+                    if attr.startswith('system'):
+                        getters.append(operator.attrgetter(attr))
+                    else:
+                        raise ValueError('unsupported attribute %s' % attr)
+                else:
+                    raise ValueError('attribute is too deep')
+            fmt = ('%s ' * len(getters)) + '\n'
+            _write_cache[key] = (getters, fmt)
         # Extract the requested attributes
-        values = []
-        for attr in attributes:
-            level = len(attr.split('.'))
-            if level == 1:
-                values.append(getattr(sim, attr))
-            elif level == 2:
-                system_attr = attr.split('.')[-1]
-                if attr.startswith('system'):
-                    values.append(getattr(sim.system, system_attr))
-            else:
-                raise ValueError('attribute is too deep')
-        # Format output string
-        fmt = ('%s ' * len(attributes)) + '\n'
+        values = [getter(sim) for getter in getters]
         with open(f, 'a') as fh:
             fh.write(fmt % tuple(values))
 
@@ -320,10 +448,12 @@ def target(sim, attribute, value):
 
     Return: the ratio between current and target values of the attribute.
     """
-    x = float(getattr(sim, attribute))
+    x = float(_cached_attrgetter(attribute)(sim))
     if value > 0:
-        frac = float(x) / value
-        _log.debug('target %s now at %g [%d]', attribute, x, int(frac * 100))
+        frac = x / value
+        # Skip the progress formatting unless it will be emitted
+        if _log.isEnabledFor(logging.DEBUG):
+            _log.debug('target %s now at %g [%d]', attribute, x, int(frac * 100))
     if x >= value:
         raise SimulationEnd('reached target %s: %s', attribute, value)
     return frac
@@ -347,12 +477,11 @@ def target_walltime(sim, value):
     limits.
     """
     wtime_limit = value
-    if sim.wall_time() > wtime_limit:
+    t = sim.wall_time()
+    if t > wtime_limit:
         raise SimulationEnd('target wall time reached')
-    else:
-        t = sim.wall_time()
-        dt = wtime_limit - t
-        _log.debug('elapsed time %g, reamining time %g', t, dt)
+    elif _log.isEnabledFor(logging.DEBUG):
+        _log.debug('elapsed time %g, reamining time %g', t, wtime_limit - t)
 
 
 def target_python_stop(sim, condition):
@@ -400,14 +529,14 @@ def shell_stop(sim, cmd, exit_code=1):
         output = subprocess.check_output(wrap_cmd, shell=True,
                                          stderr=subprocess.STDOUT, executable="/bin/bash")
         if len(output) > 0:
-            _log.info('shell command "{}" returned: {}'.format(cmd, output.strip()))
+            _log.info('shell command "%s" returned: %s', cmd, output.strip())
 
     except subprocess.CalledProcessError as e:
         # We stop the simulation
         if e.returncode == exit_code:
             raise SimulationEnd('shell command "{}" returned "{}"'.format(cmd, e.output.strip()))
         else:
-            _log.error('shell command {} failed with output {}'.format(cmd, e.output))
+            _log.error('shell command %s failed with output %s', cmd, e.output)
             raise
 
 def user_stop(sim):
@@ -419,12 +548,24 @@ def user_stop(sim):
     # To make it work in parallel we should broadcast and then rm
     # or subclass userstop in classes that use parallel execution
     if sim.output_path is not None:
+        # Rate-limit the filesystem poll: on networked filesystems the
+        # stat can dominate a tight scheduler loop
+        now = time.monotonic()
+        last = getattr(sim, '_user_stop_last_check', None)
+        if last is not None and now - last < 1.0:
+            return
+        sim._user_stop_last_check = now
         if os.path.isdir(sim.output_path):
             dirpath = sim.output_path
         else:
             dirpath = os.path.dirname(sim.output_path)
-        if os.path.exists('%s/STOP' % dirpath):
-            raise SimulationEnd('user has stopped the simulation')
+        # A single stat syscall, instead of os.path.exists which
+        # wraps it in an extra layer
+        try:
+            os.stat('%s/STOP' % dirpath)
+        except OSError:
+            return
+        raise SimulationEnd('user has stopped the simulation')
 
 # Aliases
 
@@ -436,6 +577,8 @@ class Speedometer(object):
 
     """Display speed of simulation and remaining time to reach target."""
 
+    __slots__ = ('_init', '_callback', 'x_last', 't_last')
+
     def __init__(self):
         self._init = False
 
@@ -454,32 +597,37 @@ class Speedometer(object):
                     args = sim._cbk_params[c]['args']
                     kwargs = sim._cbk_params[c]['kwargs']
                     self.x_last = c(sim, *args, **kwargs)
-                    self.t_last = time.time()
+                    self.t_last = time.monotonic()
                     self._init = True
                     return
 
-        t_now = time.time()
+        # Use the monotonic clock: it is immune to wall-clock
+        # adjustments and a single cheap vDSO call
+        t_now = time.monotonic()
         args = sim._cbk_params[self._callback]['args']
         kwargs = sim._cbk_params[self._callback]['kwargs']
         x_now = self._callback(sim, *args, **kwargs)
-        # Get the speed at which the simulation advances
-        speed = (x_now - self.x_last) / (t_now - self.t_last)
-        # Report fraction of target achieved and ETA
-        frac = float(x_now) / 1
-        try:
-            eta = (1.0 - x_now) / speed
-            d_now = datetime.datetime.now()
-            d_delta = datetime.timedelta(seconds=eta)
-            d_eta = d_now + d_delta
-            # self._callback.__name__,
-            _log.info('%2d%% ETA: %s S/T: %.1f T/SP: %.2e',
-                      int(frac * 100),
-                      d_eta.strftime('%Y-%m-%d %H.%M'),
-                      1./sim.wall_time(per_step=True),
-                      sim.wall_time(per_step=True, per_particle=True))
-        except ZeroDivisionError:
-            print(x_now, self.x_last)
-            raise
+        # Build the ETA report only if it will actually be emitted
+        if _log.isEnabledFor(logging.INFO):
+            # Get the speed at which the simulation advances
+            speed = (x_now - self.x_last) / (t_now - self.t_last)
+            # Report fraction of target achieved and ETA
+            frac = x_now
+            try:
+                eta = (1.0 - x_now) / speed
+                d_now = datetime.datetime.now()
+                d_delta = datetime.timedelta(seconds=eta)
+                d_eta = d_now + d_delta
+                # self._callback.__name__,
+                _log.info('%2d%% ETA: %s S/T: %.1f T/SP: %.2e',
+                          int(frac * 100),
+                          d_eta.strftime('%Y-%m-%d %H.%M'),
+                          1./sim.wall_time(per_step=True),
+                          sim.wall_time(per_step=True, per_particle=True))
+            except ZeroDivisionError:
+                _log.error('speedometer division by zero: x_now=%r x_last=%r',
+                           x_now, self.x_last)
+                raise
 
         self.t_last = t_now
         self.x_last = x_now
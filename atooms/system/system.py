@@ -368,6 +368,26 @@ class System(object):
             if what in aliases:
                 what_list[i] = aliases[what]
 
+        # When several particle properties are requested without views
+        # we gather them in a single pass over the particle list,
+        # instead of traversing it once per property. The properties
+        # are stored in self._data so the loop below skips them.
+        if not view and not flat and len(what_list) > 1:
+            batch = [(what, dtype) for what, dtype in zip(what_list, dtype_list)
+                     if what.startswith('particle') and what not in self._data]
+            if len(batch) > 1:
+                attrs = [what.split('.')[-1] for what, _ in batch]
+                columns = [[] for _ in attrs]
+                for p in self.particle:
+                    for column, attr in zip(columns, attrs):
+                        column.append(getattr(p, attr))
+                self._data['npart'] = len(self.particle)
+                for (what, dtype), column in zip(batch, columns):
+                    data = numpy.array(column, dtype=dtype)
+                    if order == 'F':
+                        data = numpy.transpose(data)
+                    self._data[what] = data
+
         for what, dtype in zip(what_list, dtype_list):
             # Skip if it has been dumped already
             # and the number of particles has not changed
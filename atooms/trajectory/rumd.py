@@ -7,10 +7,17 @@ import os
 import re
 import glob
 
+import numpy
+
 from atooms.system.particle import distinct_species
 from atooms.trajectory.xyz import TrajectoryXYZ
 from atooms.trajectory import SuperTrajectory
 
+# Patterns used to parse block and step indices from file names,
+# compiled once and shared by all trajectory instances
+_BLOCK_RE = re.compile(r'(trajectory|block)(\d+)')
+_STEP_RE = re.compile(r'^(\d+)$')
+
 
 class TrajectoryRUMD(TrajectoryXYZ):
     # TODO: allow reading unfolded configuration by parsing the box image integers
@@ -25,6 +32,15 @@ class TrajectoryRUMD(TrajectoryXYZ):
             self.fields = ['type', 'x', 'y', 'z', 'vx', 'vy', 'vz'] if fields is None else fields
         # The minimum id for RUMD is 0
         self._min_id = 0
+        # Cached line format for write_sample, built once per ndim
+        self._line_fmt = None
+        self._line_fmt_ndim = None
+        # Reusable frame buffer for write_sample
+        self._line_buf = []
+        # Cached header data for _comment, keyed by the species layout
+        self._comment_key = None
+        self._comment_fmt = None
+        self._comment_mass = None
 
     def read_steps(self):
         steps = super(TrajectoryRUMD, self).read_steps()
@@ -34,21 +50,22 @@ class TrajectoryRUMD(TrajectoryXYZ):
         basename = basename_ext.split('.')[0]
 
         # For native rumd trajectories we add the block offset
-        s = re.search(r'(trajectory|block)(\d+)', basename)
+        s = _BLOCK_RE.search(basename)
         if s:
             # Redefine samples and steps to make sure these are the absolute step indexes
             # This is important when trajectories are written in blocks.
             _, block = s.group(1), s.group(2)
             iblock = int(block)
             dt = steps[-1]
-            steps = [i + dt*iblock for i in steps]
+            # Shift all steps at once; the base class expects a list
+            steps = (numpy.asarray(steps, dtype=numpy.int64) + dt*iblock).tolist()
 
         # If we follow a folder based logic, files are named according
         # to the step and contain a single step like
         #     folder/0000001.xyz.gz
         # We grab the step from
         # the file name.
-        s = re.search(r'^(\d+)$', basename)
+        s = _STEP_RE.search(basename)
         if s and len(steps) == 1:
             steps = [int(basename)]
         return steps
@@ -67,34 +84,46 @@ class TrajectoryRUMD(TrajectoryXYZ):
         return meta
 
     def _comment(self, step, system):
-
-        def first_of_species(system, species):
-            for i, p in enumerate(system.particle):
-                if p.species == species:
-                    return i
-            raise ValueError('no species %d found in system' % species)
-
         sp = distinct_species(system.particle)
-        mass = [system.particle[first_of_species(system, isp)].mass for isp in sp]
-        hdr = 'ioformat=1 dt=%g timeStepIndex=%d boxLengths=' + \
-              '%.12f,%.12f,%.12f' + \
-              ' numTypes=%d mass=' + '%g,'*(len(sp)) + \
-              ' columns=type,x,y,z,vx,vy,vz\n'
-        return hdr % tuple([self.timestep, step] + list(system.cell.side) + [len(sp)] + mass)
+        # The species masses and the format template only depend on the
+        # species layout: cache them and recompute only when the number
+        # of particles or the species change.
+        key = (len(system.particle), tuple(sp))
+        if self._comment_key != key:
+            # Single pass mapping each species to its first particle
+            first_idx = {}
+            for i, p in enumerate(system.particle):
+                first_idx.setdefault(p.species, i)
+            self._comment_mass = [system.particle[first_idx[isp]].mass for isp in sp]
+            self._comment_fmt = 'ioformat=1 dt=%g timeStepIndex=%d boxLengths=' + \
+                                '%.12f,%.12f,%.12f' + \
+                                ' numTypes=%d mass=' + '%g,'*(len(sp)) + \
+                                ' columns=type,x,y,z,vx,vy,vz\n'
+            self._comment_key = key
+        return self._comment_fmt % tuple([self.timestep, step] + list(system.cell.side) +
+                                         [len(sp)] + self._comment_mass)
 
     def write_sample(self, system, step):
         sp = distinct_species(system.particle)
-        self.trajectory.write("%d\n" % len(system.particle))
-        self.trajectory.write(self._comment(step, system))
         ndim = len(system.particle[0].position)
+        if self._line_fmt_ndim != ndim:
+            self._line_fmt = "%s" + ndim*" %.6f" + ndim*" %.6f " + "\n"
+            self._line_fmt_ndim = ndim
+        fmt = self._line_fmt
+        # We get the integer index corresponding to species Ex.:
+        # if species are 'A', 'B' we get 0 and 1. Note that in
+        # general getting the sample back via read_sample() will
+        # not preserve the species. We format the whole frame into a
+        # buffer reused across frames and flush it with a single
+        # write call.
+        buf = self._line_buf
+        del buf[:]
+        append = buf.append
+        append("%d\n" % len(system.particle))
+        append(self._comment(step, system))
         for p in system.particle:
-            # We get the integer index corresponding to species Ex.:
-            # if species are 'A', 'B' we get 0 and 1. Note that in
-            # general getting the sample back via read_sample() will
-            # not preserve the species.
-            isp = sp.index(p.species)
-            self.trajectory.write(("%s"+ndim*" %.6f" + ndim*" %.6f " + "\n") %
-                                  ((isp,) + tuple(p.position) + tuple(p.velocity)))
+            append(fmt % ((sp.index(p.species),) + tuple(p.position) + tuple(p.velocity)))
+        self.trajectory.write(''.join(buf))
 
 
 class SuperTrajectoryRUMD(SuperTrajectory):
@@ -110,7 +139,12 @@ class SuperTrajectoryRUMD(SuperTrajectory):
             f_all = glob.glob(inp + '/[0-9]*gz')
             f_all.sort()
         elif len(f_all) > 0:
+            # Sort blocks by their numeric index, falling back to
+            # lexicographic order for unexpected names
+            def block_index(f):
+                s = _BLOCK_RE.search(os.path.basename(f))
+                return int(s.group(2)) if s else -1
+            f_all.sort(key=lambda f: (block_index(f), f))
             # Avoid last block because rumd does not write the last cfg!
-            f_all.sort()
             f_all = f_all[:-1]
         return SuperTrajectory(f_all, TrajectoryRUMD)
@@ -95,6 +95,28 @@ class Test(unittest.TestCase):
         self.assertTrue(os.path.exists(f))
         self.assertTrue(os.path.exists(f + '.output'))
 
+    def test_thermo_minimal_system(self):
+        # write_thermo must only rely on the minimal backend system
+        # interface, even with a non-empty particle list
+        from atooms.system.particle import Particle
+        from atooms.backends import dryrun
+        f = '/tmp/test_simulation/thermo_minimal/trajectory'
+        system = dryrun.System(particle=[Particle(), Particle()])
+        s = Simulation(DryRun(system), output_path=f, steps=40)
+        s.add(write_thermo, Scheduler(20))
+        s.run()
+        data = numpy.loadtxt(f + '.thermo', unpack=True)
+        self.assertEqual(int(data[0][-1]), 40)
+
+    def test_config_dryrun(self):
+        # write_config must accept the minimal trajectory class
+        # interface, which does not store the file name
+        f = '/tmp/test_simulation/config_dryrun/trajectory'
+        s = Simulation(DryRun(), output_path=f, steps=100)
+        s.add(write_config, Scheduler(20))
+        s.run()
+        self.assertEqual(s.current_step, 100)
+
     def test_target_rmsd(self):
         f = '/tmp/test_simulation/config/trajectory'
         with self.assertRaises(IndexError):